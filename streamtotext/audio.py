@@ -9,10 +9,22 @@ The two main base classes are :class:`AudioSource` which provides audio and
 import asyncio
 import audioop
 import collections
+import logging
+import math
+import threading
 import time
 import wave
 
-import janus
+try:
+    import numpy
+except ImportError:
+    # NumPy is only used to speed up audio math, fall back to audioop
+    numpy = None
+try:
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    # Only needed for high quality rate conversion, added in NumPy 1.20
+    sliding_window_view = None
 try:
     import pyaudio
 except ImportError:
@@ -21,6 +33,9 @@ except ImportError:
     pass
 
 
+LOG = logging.getLogger(__name__)
+
+
 class NoMoreChunksError(Exception):
     pass
 
@@ -32,26 +47,102 @@ class NoDefaultInputDeviceError(Exception):
         )
 
 
-# Using a namedtuple for audio chunks due to their lightweight nature
-AudioChunk = collections.namedtuple('AudioChunk',
-                                    ['start_time', 'audio', 'width', 'freq'])
-"""A sequence of audio samples.
+class AudioChunk(object):
+    """A sequence of audio samples.
 
-This is the low level structure used for passing audio. Typically these
-are obtained from iterating over an :class:`AudioBlock`.
+    This is the low level structure used for passing audio. Typically these
+    are obtained from iterating over an :class:`AudioBlock`.
 
-In order to make this object use minimal memory it is implemented as a
-namedtuple.
+    In order to make this object use minimal memory it uses __slots__. The
+    RMS of the chunk is computed on first use and cached, as the squelch
+    inspects each chunk several times while it is in its sliding window.
 
-:param start_time: Unix timestamp of the first sample.
-:type start_time: int
-:param audio: Bytes array of audio samples.
-:type audio: bytes
-:param width: Number of bytes per sample.
-:type width: int
-:param freq: Sampling frequency.
-:type freq: int
-"""
+    :param start_time: Unix timestamp of the first sample.
+    :type start_time: int
+    :param audio: Audio samples, any bytes-like buffer such as bytes,
+        bytearray or a memoryview into a larger buffer. Convert it with
+        bytes() where read-only bytes are needed.
+    :type audio: bytes-like object
+    :param width: Number of bytes per sample.
+    :type width: int
+    :param freq: Sampling frequency.
+    :type freq: int
+    """
+    __slots__ = ('start_time', 'audio', 'width', 'freq', '_rms')
+
+    def __init__(self, start_time, audio, width, freq):
+        self.start_time = start_time
+        self.audio = audio
+        self.width = width
+        self.freq = freq
+        self._rms = None
+
+    def __eq__(self, other):
+        if not isinstance(other, AudioChunk):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'AudioChunk(start_time=%r, audio=%r, width=%r, freq=%r)' % (
+            self.start_time, self.audio, self.width, self.freq
+        )
+
+    def _fields(self):
+        return (self.start_time, self.audio, self.width, self.freq)
+
+    @property
+    def cached_rms(self):
+        """RMS of this chunk if it was already computed, otherwise None."""
+        return self._rms
+
+    def rms(self):
+        """RMS of the audio samples in this chunk."""
+        if self._rms is None:
+            self._rms = audioop.rms(self.audio, self.width)
+        return self._rms
+
+
+class AudioChunkBatch(object):
+    """A sequence of equally sized audio chunks stored contiguously.
+
+    The audio of every chunk is concatenated into a single bytearray so that
+    :func:`rms` is done in one pass over the batch instead of once per chunk.
+    Building a batch copies the audio, so it is meant for audio which is
+    gathered once and processed as a whole, such as in
+    :func:`SquelchedSource.detect_squelch_level`.
+
+    :param chunk_bytes: Size in bytes of each chunk.
+    :type chunk_bytes: int
+    :param width: Number of bytes per sample.
+    :type width: int
+    """
+    def __init__(self, chunk_bytes, width):
+        self.data = bytearray()
+        self.chunk_bytes = chunk_bytes
+        self.width = width
+
+    def __len__(self):
+        return len(self.data) // self.chunk_bytes
+
+    def append(self, chunk):
+        """Copy the audio of a chunk onto the end of the batch.
+
+        :param chunk: Chunk of chunk_bytes bytes.
+        :type chunk: AudioChunk
+        """
+        assert len(chunk.audio) == self.chunk_bytes
+        self.data += chunk.audio
+
+    def rms(self):
+        """RMS of each chunk in the batch.
+
+        :ret: Sequence of RMS values, one per chunk.
+        """
+        if not self.data:
+            return []
+        return _rms_even(self.data, self.chunk_bytes, self.width)
 
 
 class AudioBlock(object):
@@ -62,33 +153,38 @@ class AudioBlock(object):
     would like to know at what points the squelch was triggered on and off.
     """
     def __init__(self):
-        self._stopped = asyncio.Event()
+        self._stopped = False
+        # Created on first use so that it belongs to the running loop. A
+        # single future is shared by every __anext__ rather than creating a
+        # task waiting on the stop per chunk.
+        self._stop_future = None
 
     def __aiter__(self):
         return self
 
     @property
     def ended(self):
-        return self._stopped.is_set()
+        return self._stopped
 
     def end(self):
-        self._stopped.set()
+        self._stopped = True
+        if self._stop_future is not None and not self._stop_future.done():
+            self._stop_future.set_result(None)
 
     async def __anext__(self):
-        if self._stopped.is_set():
+        if self._stopped:
             raise StopAsyncIteration()
 
+        if self._stop_future is None:
+            self._stop_future = asyncio.get_event_loop().create_future()
+
         chunk_task = asyncio.ensure_future(self._next_chunk())
-        stop_task = asyncio.ensure_future(self._stopped.wait())
         try:
-            done, pending = await asyncio.wait(
-                [chunk_task, stop_task],
+            await asyncio.wait(
+                [chunk_task, self._stop_future],
                 return_when=asyncio.FIRST_COMPLETED
             )
 
-            for task in pending:
-                task.cancel()
-
             if chunk_task.done():
                 try:
                     return chunk_task.result()
@@ -99,19 +195,115 @@ class AudioBlock(object):
                 raise StopAsyncIteration()
         finally:
             chunk_task.cancel()
-            stop_task.cancel()
+
+
+class SPSCRing(object):
+    """Bounded queue for a single producer thread and a single consumer.
+
+    The ring supports the subset of the :class:`asyncio.Queue` interface used
+    by :class:`QueueAudioBlock`. Items are stored in a preallocated list
+    indexed by a read and a write counter which are each only advanced by one
+    side, so pushes and pops take no lock. The producer only wakes the event
+    loop when the consumer is waiting on an empty ring.
+
+    Only one thread may put and only the event loop thread may get.
+
+    :parameter capacity: Maximum number of queued items.
+    :type capacity: int
+    :parameter loop: Event loop the consumer runs in.
+    :type loop: asyncio.AbstractEventLoop
+    """
+    def __init__(self, capacity, loop=None):
+        self._items = [None] * capacity
+        self._capacity = capacity
+        self._read = 0
+        self._write = 0
+        self._loop = loop or asyncio.get_event_loop()
+        self._waiter = None
+
+    def qsize(self):
+        return self._write - self._read
+
+    def empty(self):
+        return self._write == self._read
+
+    def full(self):
+        return self._write - self._read >= self._capacity
+
+    def put_nowait(self, item):
+        if self.full():
+            raise asyncio.QueueFull()
+        self._items[self._write % self._capacity] = item
+        self._write += 1
+        # Read after the write above, the consumer sets _waiter before
+        # checking for items so one of the two always sees the other
+        waiter = self._waiter
+        if waiter is not None:
+            self._loop.call_soon_threadsafe(self._wake, waiter)
+
+    async def put(self, item):
+        self.put_nowait(item)
+
+    def get_nowait(self):
+        if self.empty():
+            raise asyncio.QueueEmpty()
+        ndx = self._read % self._capacity
+        item = self._items[ndx]
+        self._items[ndx] = None
+        self._read += 1
+        return item
+
+    async def get(self):
+        while self.empty():
+            self._waiter = self._loop.create_future()
+            try:
+                if self.empty():
+                    await self._waiter
+            finally:
+                self._waiter = None
+        return self.get_nowait()
+
+    @staticmethod
+    def _wake(waiter):
+        if not waiter.done():
+            waiter.set_result(None)
 
 
 class QueueAudioBlock(AudioBlock):
-    def __init__(self, queue=None):
+    """Audio block of chunks put on a queue, ended by putting None.
+
+    :parameter queue: Queue to get chunks from, a new one by default.
+    :type queue: asyncio.Queue
+    :parameter target_samples: When set, chunks which are already queued are
+        merged with the next chunk until at least this many samples have been
+        gathered, which avoids a loop wakeup per small chunk.
+    :type target_samples: int
+    """
+    def __init__(self, queue=None, target_samples=None):
         self._q = queue or asyncio.Queue()
+        self._target_samples = target_samples
+        self._q_ended = False
         super(QueueAudioBlock, self).__init__()
 
     async def _next_chunk(self):
-        chunk = await self._q.get()
+        chunk = None if self._q_ended else await self._q.get()
         if chunk is None:
             raise StopAsyncIteration('No more audio chunks')
-        return chunk
+        if self._target_samples is None:
+            return chunk
+
+        chunks = [chunk]
+        sample_cnt = len(chunk.audio) // chunk.width
+        while sample_cnt < self._target_samples and not self._q.empty():
+            chunk = self._q.get_nowait()
+            if chunk is None:
+                self._q_ended = True
+                break
+            chunks.append(chunk)
+            sample_cnt += len(chunk.audio) // chunk.width
+        if len(chunks) == 1:
+            return chunks[0]
+        return merge_chunks(chunks)
 
     async def add_chunk(self, chunk):
         await self._q.put(chunk)
@@ -123,10 +315,19 @@ def chunk_sample_cnt(chunk):
     :param chunk: The chunk to examine.
     :type chink: AudioChunk
     """
-    return int(len(chunk.audio) / chunk.width)
+    return len(chunk.audio) // chunk.width
 
 
 def merge_chunks(chunks):
+    """Concatenate a sequence of chunks into a single chunk.
+
+    The output is sized once and the audio of each chunk is copied into it
+    once. The merged audio is always bytes, whatever buffer type the input
+    chunks hold.
+
+    :param chunks: Chunks to merge, must be non empty.
+    :type chunks: Sequence of AudioChunk
+    """
     assert(len(chunks) > 0)
     audio = b''.join([x.audio for x in chunks])
     return AudioChunk(chunks[0].start_time,
@@ -136,9 +337,20 @@ def merge_chunks(chunks):
 
 
 def split_chunk(chunk, sample_offset):
+    """Split a chunk in two at a sample offset.
+
+    The audio of both resulting chunks are memoryview slices of the audio of
+    the original chunk, no audio is copied.
+
+    :param chunk: The chunk to split.
+    :type chunk: AudioChunk
+    :param sample_offset: Number of samples in the first resulting chunk.
+    :type sample_offset: int
+    """
     offset = int(sample_offset * chunk.width)
-    first_audio = memoryview(chunk.audio)[:offset]
-    second_audio = memoryview(chunk.audio)[offset:]
+    audio = memoryview(chunk.audio)
+    first_audio = audio[:offset]
+    second_audio = audio[offset:]
     first_chunk = AudioChunk(
         chunk.start_time, first_audio, chunk.width, chunk.freq
     )
@@ -148,6 +360,41 @@ def split_chunk(chunk, sample_offset):
     return first_chunk, second_chunk
 
 
+def _rms_even(audio, chunk_bytes, width):
+    """RMS of each consecutive chunk_bytes sized piece of audio.
+
+    :param audio: Audio samples, a multiple of chunk_bytes long.
+    :type audio: bytes-like
+    :param chunk_bytes: Size in bytes of each piece.
+    :type chunk_bytes: int
+    :param width: Number of bytes per sample.
+    :type width: int
+    """
+    if numpy is not None and width == 2 and chunk_bytes > 0:
+        buf = numpy.frombuffer(audio, dtype=numpy.int16)
+        buf = buf.reshape(-1, chunk_bytes // width).astype(numpy.int32)
+        return numpy.sqrt((buf * buf).mean(axis=1))
+    with memoryview(audio) as audio_view:
+        return [audioop.rms(audio_view[ndx:ndx + chunk_bytes], width)
+                for ndx in range(0, len(audio), chunk_bytes)]
+
+
+# Below this many values sorting a list beats the overhead of a NumPy call
+_SELECT_NUMPY_MIN = 64
+
+
+def _select(vals, ndx):
+    """Value which would be at ndx if vals were sorted.
+
+    This is an O(n) selection with numpy.partition rather than a sort when
+    there are enough values, or when they already are a NumPy array.
+    """
+    if numpy is not None:
+        if isinstance(vals, numpy.ndarray) or len(vals) >= _SELECT_NUMPY_MIN:
+            return numpy.partition(vals, ndx)[ndx]
+    return sorted(vals)[ndx]
+
+
 class EvenChunkIterator(object):
     """Iterate over chunks from an audio source in even sized increments.
 
@@ -159,31 +406,68 @@ class EvenChunkIterator(object):
     def __init__(self, iterator, chunk_size):
         self._iterator = iterator
         self._chunk_size = chunk_size
-        self._cur_chunk = None
+        # Audio of the last source chunk which has not been returned or
+        # copied into _buff yet. When _buff is empty returned chunks are
+        # sliced straight out of it without copying.
+        self._pending = memoryview(b'')
+        # Audio not yet returned is _buff[_head:]. Returned audio is only
+        # dropped from the front of _buff once it makes up half of it, which
+        # keeps the cost of compacting amortized over returned chunks.
+        self._buff = bytearray()
+        self._head = 0
+        self._start_time = None
+        self._width = None
+        self._freq = None
 
     def __aiter__(self):
         return self
 
-    async def __anext__(self):
-        sample_queue = collections.deque()
-
-        ret_chunk_size = 0
-        while ret_chunk_size < self._chunk_size:
-            chunk = self._cur_chunk or await self._iterator.__anext__()
-            self._cur_chunk = None
-            cur_chunk_size = chunk_sample_cnt(chunk)
-            ret_chunk_size += cur_chunk_size
-            sample_queue.append(chunk)
+    def attach(self, iterator):
+        """Start iterating over a new iterator, dropping any buffered audio.
 
-            if ret_chunk_size > self._chunk_size:
-                # We need to break up the chunk
-                merged_chunk = merge_chunks(sample_queue)
-                ret_chunk, leftover_chunk = split_chunk(merged_chunk,
-                                                        self._chunk_size)
-                self._cur_chunk = leftover_chunk
-                return ret_chunk
+        :parameter iterator: Iterator over audio chunks.
+        :type iterator: Iterator
+        """
+        self._iterator = iterator
+        self._pending = memoryview(b'')
+        del self._buff[:]
+        self._head = 0
+        self._start_time = None
+
+    def _next_audio(self):
+        """Audio for the next chunk if enough has been gathered, else None."""
+        need = self._chunk_size * self._width
+        if self._head == len(self._buff) and len(self._pending) >= need:
+            audio = self._pending[:need]
+            self._pending = self._pending[need:]
+            return audio
+
+        if len(self._pending) > 0:
+            self._buff += self._pending
+            self._pending = memoryview(b'')
+        if len(self._buff) - self._head < need:
+            return None
+
+        start = self._head
+        self._head += need
+        with memoryview(self._buff) as buff_view:
+            audio = bytes(buff_view[start:self._head])
+        if self._head * 2 >= len(self._buff):
+            del self._buff[:self._head]
+            self._head = 0
+        return audio
 
-        return merge_chunks(sample_queue)
+    async def __anext__(self):
+        audio = None if self._width is None else self._next_audio()
+        while audio is None:
+            chunk = await self._iterator.__anext__()
+            if self._head == len(self._buff):
+                self._start_time = chunk.start_time
+            self._width = chunk.width
+            self._freq = chunk.freq
+            self._pending = memoryview(chunk.audio)
+            audio = self._next_audio()
+        return AudioChunk(self._start_time, audio, self._width, self._freq)
 
 
 class RememberingIterator(object):
@@ -195,6 +479,15 @@ class RememberingIterator(object):
     def __aiter__(self):
         return self
 
+    def attach(self, iterator):
+        """Start iterating over a new iterator, forgetting remembered chunks.
+
+        :parameter iterator: Iterator over audio chunks.
+        :type iterator: Iterator
+        """
+        self._iterator = iterator
+        self._buff.clear()
+
     async def __anext__(self):
         ret = await self._iterator.__anext__()
         self._buff.append(ret)
@@ -311,54 +604,128 @@ class Microphone(AudioSource):
     :type rate: int
     :parameter device_ndx: PyAudio device index
     :type device_ndx: int
+    :parameter target_samples: Merge buffers which queued up while waiting
+        for the consumer into chunks of at least this many samples.
+    :type target_samples: int
+    :parameter chunk_frames: Number of frames read from the device at a time.
+    :type chunk_frames: int
+    :parameter queue_chunks: Maximum number of chunks waiting for the
+        consumer, further chunks are dropped until it catches up. The
+        number of dropped chunks is kept in :attr:`dropped_chunks`.
+    :type queue_chunks: int
     """
     def __init__(self,
                  audio_format=None,
                  channels=1,
                  rate=16000,
-                 device_ndx=0):
+                 device_ndx=0,
+                 target_samples=None,
+                 chunk_frames=1024,
+                 queue_chunks=256):
         super(Microphone, self).__init__()
-        audio_format = audio_format or pyaudio.paInt16
         self._format = audio_format
         self._channels = channels
         self._rate = rate
         self._device_ndx = device_ndx
+        self._target_samples = target_samples
+        self._chunk_frames = chunk_frames
+        self._queue_chunks = queue_chunks
         self._pyaudio = None
         self._stream = None
         self._stream_queue = None
+        self._reader_thread = None
+        self._stop_reading = None
+        self._read_error = None
+        self.dropped_chunks = 0
 
     async def start(self):
         await super(Microphone, self).start()
+        self._read_error = None
+        self.dropped_chunks = 0
         loop = asyncio.get_event_loop()
-        self._stream_queue = janus.Queue(loop=loop)
+        self._stream_queue = SPSCRing(self._queue_chunks, loop)
 
         self._pyaudio = pyaudio.PyAudio()
         self._stream = self._pyaudio.open(
             input=True,
-            format=self._format,
+            format=self._format or pyaudio.paInt16,
             channels=self._channels,
             rate=self._rate,
             input_device_index=self._device_ndx,
-            stream_callback=self._stream_callback
+            frames_per_buffer=self._chunk_frames
         )
+        self._stop_reading = threading.Event()
+        self._reader_thread = threading.Thread(target=self._read_stream,
+                                               daemon=True)
+        self._reader_thread.start()
 
     async def stop(self):
-        await self._stream_queue.async_q.put(None)
+        self._stop_reading.set()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._reader_thread.join)
+        # The reader thread has exited so the loop may now act as producer.
+        # If the ring is full the last block is still ended by stop() below.
+        try:
+            self._stream_queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
         await super(Microphone, self).stop()
         self._stream.stop_stream()
         self._stream.close()
         self._pyaudio.terminate()
 
     async def _next_block(self):
-        return QueueAudioBlock(self._stream_queue.async_q)
+        # Deliver the chunks read before the error first
+        if self._read_error is not None and self._stream_queue.empty():
+            raise self._read_error
+        return QueueAudioBlock(self._stream_queue, self._target_samples)
+
+    def _read_stream(self):
+        # Runs in _reader_thread, the only producer for _stream_queue
+        chunk_time = self._chunk_frames / self._rate
+        dropping = False
+        try:
+            while self.running and not self._stop_reading.is_set():
+                in_data = self._stream.read(self._chunk_frames,
+                                            exception_on_overflow=False)
+                chunk = AudioChunk(start_time=time.time() - chunk_time,
+                                   audio=in_data, freq=self._rate, width=2)
+                try:
+                    self._stream_queue.put_nowait(chunk)
+                    dropping = False
+                except asyncio.QueueFull:
+                    # Same as an input overflow, the consumer is too slow
+                    self.dropped_chunks += 1
+                    if not dropping:
+                        LOG.warning('Microphone queue is full, dropping '
+                                    'chunks (%d dropped so far)',
+                                    self.dropped_chunks)
+                    dropping = True
+        except Exception as e:
+            # The error is raised to the consumer when it asks for the next
+            # block
+            LOG.exception('Reading from microphone failed')
+            self._read_error = e
+        finally:
+            # Always end the current block, or its consumer waits forever
+            self._put_end_marker(chunk_time)
+
+    def _put_end_marker(self, retry_time):
+        while not self._stop_reading.is_set():
+            try:
+                self._stream_queue.put_nowait(None)
+                return
+            except asyncio.QueueFull:
+                self._stop_reading.wait(retry_time)
+
 
-    def _stream_callback(self, in_data, frame_count,
-                         time_info, status_flags):
-        chunk = AudioChunk(start_time=time_info['input_buffer_adc_time'],
-                           audio=in_data, freq=self._rate, width=2)
-        self._stream_queue.sync_q.put(chunk)
-        retflag = pyaudio.paContinue if self.running else pyaudio.paComplete
-        return (None, retflag)
+def _to_mono(frames, width):
+    """Average the channels of stereo audio frames."""
+    if numpy is not None and width == 2:
+        stereo = numpy.frombuffer(frames, dtype=numpy.int16).reshape(-1, 2)
+        mono = (stereo[:, 0].astype(numpy.int32) + stereo[:, 1]) >> 1
+        return mono.astype(numpy.int16).tobytes()
+    return audioop.tomono(frames, width, .5, .5)
 
 
 class _WaveAudioBlock(AudioBlock):
@@ -369,11 +736,12 @@ class _WaveAudioBlock(AudioBlock):
         self._sampwidth = sampwidth
         self._samprate = samprate
         self._n_channels = n_channels
+        self._downmix = n_channels == 2
 
     async def _next_chunk(self):
         frames = self._wave_fp.readframes(self._nframes)
-        if self._n_channels == 2:
-            frames = audioop.tomono(frames, self._sampwidth, .5, .5)
+        if self._downmix:
+            frames = _to_mono(frames, self._sampwidth)
         if len(frames) == 0:
             raise StopAsyncIteration('No more frames in wav')
         chunk = AudioChunk(0, audio=frames, width=self._sampwidth,
@@ -420,31 +788,130 @@ class WaveSource(SingleBlockAudioSource):
                                self._width, self._channels)
 
 
+class _PolyphaseResampler(object):
+    """Streaming polyphase FIR resampler for mono 16 bit audio.
+
+    The rate is converted by upsampling by up, low pass filtering and
+    downsampling by down. The filter is a Kaiser windowed sinc split into up
+    phases, so only the taps which line up with input samples are evaluated
+    and only for the output samples which are kept. Enough input is carried
+    over between calls for the filter to run continuously across chunks.
+
+    :parameter in_rate: Input sampling frequency.
+    :type in_rate: int
+    :parameter out_rate: Output sampling frequency.
+    :type out_rate: int
+    """
+    def __init__(self, in_rate, out_rate):
+        gcd = math.gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self._up = out_rate // gcd
+        self._down = in_rate // gcd
+
+        max_rate = max(self._up, self._down)
+        half_len = 10 * max_rate
+        n = numpy.arange(-half_len, half_len + 1)
+        h = numpy.sinc(n / max_rate) / max_rate * self._up
+        h *= numpy.kaiser(len(h), 5.0)
+
+        self._taps = -(-len(h) // self._up)
+        h = numpy.concatenate((h, numpy.zeros(self._taps * self._up - len(h))))
+        # _phases[p, taps - 1 - j] is the tap applied to the input sample j
+        # samples before an output sample at upsampled phase p, so a row lines
+        # up with a window of input samples in stream order
+        self._phases = numpy.ascontiguousarray(
+            h.reshape(self._taps, self._up).T[:, ::-1], dtype=numpy.float32
+        )
+        self._hist = numpy.zeros(self._taps - 1, dtype=numpy.float32)
+        # Upsampled position of the next output sample relative to the first
+        # input sample of the next call
+        self._pos = 0
+
+    def process(self, audio):
+        if len(audio) == 0:
+            return b''
+        samples = numpy.frombuffer(audio, dtype=numpy.int16)
+        x = numpy.concatenate((self._hist, samples.astype(numpy.float32)))
+        in_end = len(samples) * self._up
+        out_cnt = max(0, -(-(in_end - self._pos) // self._down))
+        positions = self._pos + numpy.arange(out_cnt) * self._down
+        windows = sliding_window_view(x, self._taps)[positions // self._up]
+        y = numpy.einsum('ij,ij->i', self._phases[positions % self._up],
+                         windows)
+        self._pos += out_cnt * self._down - in_end
+        # Copied so the history does not keep all of x alive
+        self._hist = x[len(x) - (self._taps - 1):].copy()
+        numpy.rint(y, out=y)
+        numpy.clip(y, -32768, 32767, out=y)
+        return y.astype(numpy.int16).tobytes()
+
+
 class _RateConvertBlock(AudioBlock):
-    def __init__(self, src_block, n_channels, out_rate):
+    # Each chunk gets its own output buffer. Consumers may hold on to chunks
+    # (e.g. to merge them later), so handing out views of a reused buffer
+    # would let later chunks overwrite their audio.
+    def __init__(self, src_block, n_channels, out_rate, quality):
         super(_RateConvertBlock, self).__init__()
         self._src_block = src_block
         self._n_channels = n_channels
         self._out_rate = out_rate
+        self._high_quality = quality == RateConvert.HIGH_QUALITY
         self._state = None
+        self._resampler = None
+
+    def _convert(self, chunk):
+        if not self._high_quality or self._n_channels != 1:
+            new_aud, self._state = audioop.ratecv(chunk.audio, 2,
+                                                  self._n_channels,
+                                                  chunk.freq, self._out_rate,
+                                                  self._state)
+            return new_aud
+        if chunk.freq == self._out_rate:
+            return chunk.audio
+        if self._resampler is None or self._resampler.in_rate != chunk.freq:
+            self._resampler = _PolyphaseResampler(chunk.freq, self._out_rate)
+        return self._resampler.process(chunk.audio)
 
     async def _next_chunk(self):
         chunk = await self._src_block.__anext__()
-        new_aud, self._state = audioop.ratecv(chunk.audio, 2, self._n_channels,
-                                              chunk.freq, self._out_rate,
-                                              self._state)
+        new_aud = self._convert(chunk)
         return AudioChunk(chunk.start_time, new_aud, 2, self._out_rate)
 
 
 class RateConvert(AudioSourceProcessor):
-    def __init__(self, source, n_channels, out_rate):
+    """Convert the sampling frequency of an audio source.
+
+    :parameter source: Input source
+    :type source: AudioSource
+    :parameter n_channels: Number of channels in the input audio.
+    :type n_channels: int
+    :parameter out_rate: Output sampling frequency.
+    :type out_rate: int
+    :parameter quality: FAST_QUALITY (default) uses audioop's linear
+        interpolation. HIGH_QUALITY uses a band limited polyphase filter, which
+        avoids aliasing but costs several times more CPU and requires NumPy
+        1.20 or newer. It only applies to mono audio, other audio always uses
+        audioop.
+    :type quality: str
+    """
+    FAST_QUALITY = 'fast'
+    HIGH_QUALITY = 'high'
+
+    def __init__(self, source, n_channels, out_rate, quality=FAST_QUALITY):
         super(RateConvert, self).__init__(source)
+        if quality not in (self.FAST_QUALITY, self.HIGH_QUALITY):
+            raise ValueError('Unknown rate conversion quality: %s' % quality)
+        if quality == self.HIGH_QUALITY and sliding_window_view is None:
+            raise ValueError('High quality rate conversion requires NumPy '
+                             '1.20 or newer')
         self._n_channels = n_channels
         self._out_rate = out_rate
+        self._quality = quality
 
     async def _next_block(self):
         src_block = await self._source.__anext__()
-        return _RateConvertBlock(src_block, self._n_channels, self._out_rate)
+        return _RateConvertBlock(src_block, self._n_channels, self._out_rate,
+                                 self._quality)
 
 
 class SquelchedBlock(AudioBlock):
@@ -501,26 +968,40 @@ class SquelchedSource(AudioSourceProcessor):
         self._prefix_samples = prefix_samples
         self._sample_width = 2
         self._src_block = None
+        # Reattached to each new source block rather than recreated
+        self._even_iter = None
+        self._mem_iter = None
 
     @staticmethod
     def check_squelch(level, is_triggered, chunks):
-        rms_vals = [audioop.rms(x.audio, x.width) for x in chunks]
-        median_rms = sorted(rms_vals)[int(len(rms_vals) * .5)]
+        # The squelch is (or stays) triggered when the median RMS, the value
+        # at len(chunks) // 2 of the sorted RMS values, passes the threshold.
+        # That is decided as soon as enough values pass or fail, so chunks
+        # with a cached RMS are counted first and RMS is only computed for
+        # the remaining chunks when they are needed to decide.
         if is_triggered:
-            if median_rms < (level * .8):
-                return False
-            else:
-                return True
+            def passes(rms):
+                return rms >= level * .8
         else:
-            if median_rms > level:
-                return True
-            else:
-                return False
+            def passes(rms):
+                return rms > level
+
+        needed_passes = len(chunks) - len(chunks) // 2
+        cached = [rms for rms in (x.cached_rms for x in chunks)
+                  if rms is not None]
+        passed = sum(1 for rms in cached if passes(rms))
+        failed = len(cached) - passed
+        if passed >= needed_passes or failed > len(chunks) // 2:
+            return passed >= needed_passes
+        passed += sum(1 for x in chunks
+                      if x.cached_rms is None and passes(x.rms()))
+        return passed >= needed_passes
 
     async def detect_squelch_level(self, detect_time=10, threshold=.8):
         start_time = time.time()
         end_time = start_time + detect_time
-        audio_chunks = collections.deque()
+        chunk_bytes = self._sample_size * self._sample_width
+        batch = AudioChunkBatch(chunk_bytes, self._sample_width)
         async with self._source.listen():
             async for block in self._source:
                 if time.time() > end_time:
@@ -528,14 +1009,14 @@ class SquelchedSource(AudioSourceProcessor):
                 even_iter = EvenChunkIterator(block, self._sample_size)
                 try:
                     while time.time() < end_time:
-                        audio_chunks.append(await even_iter.__anext__())
+                        chunk = await even_iter.__anext__()
+                        if len(chunk.audio) == chunk_bytes:
+                            batch.append(chunk)
                 except StopAsyncIteration:
                     pass
 
-        rms_vals = [audioop.rms(x.audio, self._sample_width) for x in
-                    audio_chunks
-                    if len(x.audio) == self._sample_size * self._sample_width]
-        level = sorted(rms_vals)[int(threshold * len(rms_vals)):][0]
+        rms_vals = batch.rms()
+        level = float(_select(rms_vals, int(threshold * len(rms_vals))))
         self.squelch_level = level
         return level
 
@@ -546,9 +1027,14 @@ class SquelchedSource(AudioSourceProcessor):
     async def _next_block(self):
         if self._src_block is None or self._src_block.ended:
             self._src_block = await self._source.__anext__()
-            even_iter = EvenChunkIterator(self._src_block, self._sample_size)
-            self._mem_iter = RememberingIterator(even_iter,
-                                                 self._prefix_samples)
+            if self._mem_iter is None:
+                self._even_iter = EvenChunkIterator(self._src_block,
+                                                    self._sample_size)
+                self._mem_iter = RememberingIterator(self._even_iter,
+                                                     self._prefix_samples)
+            else:
+                self._even_iter.attach(self._src_block)
+                self._mem_iter.attach(self._even_iter)
         async for _ in self._mem_iter:  # NOQA
             if SquelchedSource.check_squelch(self.squelch_level,
                                              False,
@@ -594,7 +1080,8 @@ class AudioPlayer(object):
         async with self._source.listen():
             async for block in self._source:
                 async for chunk in block:
-                    stream.write(chunk.audio)
+                    # PyAudio only accepts read-only bytes
+                    stream.write(bytes(chunk.audio))
 
         stream.stop_stream()
         stream.close()
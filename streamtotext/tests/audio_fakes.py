@@ -41,3 +41,50 @@ class SilentAudioBlock(GeneratedAudioBlock):
 class SilentAudioSource(audio.SingleBlockAudioSource):
     async def _get_block(self):
         return SilentAudioBlock()
+
+
+class FailingStream(object):
+    """Fake pyaudio stream which raises an error after some reads."""
+    def __init__(self, reads, frame_bytes=2, error=OSError):
+        self._reads = reads
+        self._frame_bytes = frame_bytes
+        self._error = error
+
+    def read(self, frames, exception_on_overflow=True):
+        if self._reads == 0:
+            raise self._error('Stream closed')
+        self._reads -= 1
+        return b'\0' * (frames * self._frame_bytes)
+
+
+class FakeOutputStream(object):
+    """Fake pyaudio output stream which keeps the written audio."""
+    def __init__(self):
+        self.written = []
+
+    def write(self, frames):
+        # PyAudio parses frames with "s#", which rejects mutable buffers
+        if not isinstance(frames, bytes):
+            raise TypeError('a bytes object is required')
+        self.written.append(frames)
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePyAudio(object):
+    """Fake pyaudio.PyAudio which opens a single FakeOutputStream."""
+    def __init__(self):
+        self.stream = FakeOutputStream()
+
+    def get_format_from_width(self, width):
+        return width
+
+    def open(self, **kwargs):
+        return self.stream
+
+    def terminate(self):
+        pass
@@ -1,6 +1,9 @@
 import asyncio
+import audioop
 import os
+import threading
 import time
+from unittest import mock
 
 from streamtotext import audio
 from streamtotext.tests import audio_fakes
@@ -50,6 +53,142 @@ class SilentSourceTestCase(base.TestCase):
         self.assertAlmostEqual(start_time + .2, time.time(), delta=.2)
 
 
+class AudioBlockTestCase(base.TestCase):
+    async def test_end_while_waiting(self):
+        block = audio.QueueAudioBlock()
+        next_task = asyncio.ensure_future(block.__anext__())
+        await asyncio.sleep(0)
+        block.end()
+        with self.assertRaises(StopAsyncIteration):
+            await next_task
+        self.assertTrue(block.ended)
+
+    async def test_chunks_after_wait(self):
+        block = audio.QueueAudioBlock()
+        chunk = audio.AudioChunk(0, b'\0\0', 2, 16000)
+        for _ in range(3):
+            await block.add_chunk(chunk)
+        await block.add_chunk(None)
+        chunks = []
+        async for x in block:
+            chunks.append(x)
+        self.assertEqual([chunk] * 3, chunks)
+        self.assertTrue(block.ended)
+
+    async def test_queue_batches_chunks(self):
+        block = audio.QueueAudioBlock(target_samples=3)
+        for i in range(5):
+            await block.add_chunk(audio.AudioChunk(i, bytes([i, 0]), 2,
+                                                   16000))
+        await block.add_chunk(None)
+        chunks = []
+        async for chunk in block:
+            chunks.append(chunk)
+        self.assertEqual([0, 3], [x.start_time for x in chunks])
+        self.assertEqual([b'\0\0\1\0\2\0', b'\3\0\4\0'],
+                         [bytes(x.audio) for x in chunks])
+
+
+class SPSCRingTestCase(base.TestCase):
+    async def test_thread_producer(self):
+        ring = audio.SPSCRing(8, asyncio.get_event_loop())
+
+        def produce():
+            for ndx in range(100):
+                while True:
+                    try:
+                        ring.put_nowait(ndx)
+                        break
+                    except asyncio.QueueFull:
+                        time.sleep(.001)
+
+        thread = threading.Thread(target=produce)
+        thread.start()
+        items = []
+        for _ in range(100):
+            items.append(await asyncio.wait_for(ring.get(), 5))
+        thread.join()
+        self.assertEqual(list(range(100)), items)
+        self.assertTrue(ring.empty())
+
+    async def test_full(self):
+        ring = audio.SPSCRing(2, asyncio.get_event_loop())
+        ring.put_nowait(1)
+        ring.put_nowait(2)
+        with self.assertRaises(asyncio.QueueFull):
+            ring.put_nowait(3)
+        self.assertEqual(1, ring.get_nowait())
+        ring.put_nowait(3)
+        self.assertEqual([2, 3], [ring.get_nowait(), ring.get_nowait()])
+        with self.assertRaises(asyncio.QueueEmpty):
+            ring.get_nowait()
+
+    async def test_queue_block(self):
+        ring = audio.SPSCRing(8, asyncio.get_event_loop())
+        block = audio.QueueAudioBlock(ring, target_samples=2)
+        for ndx in range(3):
+            ring.put_nowait(audio.AudioChunk(ndx, b'\0\0', 2, 16000))
+        ring.put_nowait(None)
+        sample_cnts = []
+        async for chunk in block:
+            sample_cnts.append(len(chunk.audio) // 2)
+        self.assertEqual([2, 1], sample_cnts)
+
+
+class MicrophoneTestCase(base.TestCase):
+    def _fake_mic(self, stream, queue_chunks):
+        mic = audio.Microphone(chunk_frames=4)
+        mic.running = True
+        mic._stream = stream
+        mic._stream_queue = audio.SPSCRing(queue_chunks,
+                                           asyncio.get_event_loop())
+        mic._stop_reading = threading.Event()
+        return mic
+
+    async def _assert_read_error_ends_block(self, error):
+        loop = asyncio.get_event_loop()
+        mic = self._fake_mic(audio_fakes.FailingStream(2, error=error), 8)
+        with self.assertLogs('streamtotext.audio', 'ERROR'):
+            await asyncio.wait_for(
+                loop.run_in_executor(None, mic._read_stream), 5)
+
+        block = await mic._next_block()
+        chunks = []
+        async for chunk in block:
+            chunks.append(chunk)
+        self.assertEqual(2, len(chunks))
+        with self.assertRaises(error):
+            await mic._next_block()
+
+    async def test_read_error_ends_block(self):
+        await self._assert_read_error_ends_block(OSError)
+
+    async def test_unexpected_error_ends_block(self):
+        await self._assert_read_error_ends_block(ValueError)
+
+    async def test_full_queue_counts_dropped(self):
+        loop = asyncio.get_event_loop()
+        mic = self._fake_mic(audio_fakes.FailingStream(5), 2)
+
+        async def wait_dropped():
+            while mic.dropped_chunks < 3:
+                await asyncio.sleep(.01)
+
+        with self.assertLogs('streamtotext.audio', 'WARNING') as logs:
+            read = loop.run_in_executor(None, mic._read_stream)
+            try:
+                await asyncio.wait_for(wait_dropped(), 5)
+                # Make room for the end marker once all reads happened
+                await mic._stream_queue.get()
+                await asyncio.wait_for(read, 5)
+            finally:
+                # Let the reader give up on the end marker if the test failed
+                mic._stop_reading.set()
+        self.assertEqual(3, mic.dropped_chunks)
+        self.assertEqual(['WARNING', 'ERROR'],
+                         [x.levelname for x in logs.records])
+
+
 class ChunkTestCase(base.TestCase):
     async def test_split_join_chunk(self):
         chunk_audio = bytes(range(100))
@@ -58,6 +197,71 @@ class ChunkTestCase(base.TestCase):
         cmp_chunk = audio.merge_chunks((left_chunk, right_chunk))
         self.assertEqual(chunk, cmp_chunk)
 
+    async def test_merge_chunks_bytes(self):
+        chunk_audio = bytearray(range(100))
+        chunk = audio.AudioChunk(time.time(), chunk_audio, 2, 16000)
+        left_chunk, right_chunk = audio.split_chunk(chunk, 20)
+        merged = audio.merge_chunks((left_chunk, right_chunk))
+        self.assertIs(bytes, type(merged.audio))
+        self.assertEqual(bytes(chunk_audio), merged.audio)
+
+    async def test_queue_block_merged_bytes(self):
+        block = audio.QueueAudioBlock(target_samples=4)
+        for ndx in range(2):
+            await block.add_chunk(audio.AudioChunk(ndx, bytearray(4), 2,
+                                                   16000))
+        await block.add_chunk(None)
+        chunks = []
+        async for chunk in block:
+            chunks.append(chunk)
+        self.assertEqual(1, len(chunks))
+        self.assertIs(bytes, type(chunks[0].audio))
+
+    async def test_split_chunk_no_copy(self):
+        chunk_audio = bytearray(range(100))
+        chunk = audio.AudioChunk(time.time(), chunk_audio, 2, 16000)
+        left_chunk, right_chunk = audio.split_chunk(chunk, 20)
+        self.assertIsInstance(left_chunk.audio, memoryview)
+        self.assertIsInstance(right_chunk.audio, memoryview)
+        chunk_audio[0] = 255
+        chunk_audio[40] = 255
+        self.assertEqual(255, left_chunk.audio[0])
+        self.assertEqual(255, right_chunk.audio[0])
+
+
+class RmsTestCase(base.TestCase):
+    async def test_rms_matches_audioop(self):
+        chunk_audio = bytes(range(100))
+        chunk = audio.AudioChunk(time.time(), chunk_audio, 2, 16000)
+        self.assertEqual(audioop.rms(chunk_audio, 2), chunk.rms())
+
+    async def test_rms_cached(self):
+        chunk = audio.AudioChunk(time.time(), b'\1\0' * 10, 2, 16000)
+        self.assertEqual(1, chunk.rms())
+        chunk.audio = b'\0\0' * 10
+        self.assertEqual(1, chunk.rms())
+
+    async def test_cached_rms(self):
+        chunk = audio.AudioChunk(time.time(), b'\1\0' * 10, 2, 16000)
+        self.assertIsNone(chunk.cached_rms)
+        chunk.rms()
+        self.assertEqual(1, chunk.cached_rms)
+
+
+class AudioChunkBatchTestCase(base.TestCase):
+    async def test_rms(self):
+        audios = (bytes(range(40)), bytes(range(100, 140)),
+                  bytes(range(30, 70)))
+        batch = audio.AudioChunkBatch(40, 2)
+        for ndx, chunk_audio in enumerate(audios):
+            batch.append(audio.AudioChunk(ndx, chunk_audio, 2, 16000))
+        self.assertEqual(len(audios), len(batch))
+        for chunk_audio, rms in zip(audios, batch.rms()):
+            self.assertAlmostEqual(audioop.rms(chunk_audio, 2), rms, delta=1)
+
+    async def test_rms_empty(self):
+        self.assertEqual([], audio.AudioChunkBatch(40, 2).rms())
+
 
 class EvenChunkIteratorTestCase(base.TestCase):
     async def test_uneven_chunks(self):
@@ -73,6 +277,18 @@ class EvenChunkIteratorTestCase(base.TestCase):
         async for chunk in audio.EvenChunkIterator(chunk_iter, 100):
             self.assertEqual(200, len(chunk.audio))
 
+    async def test_uneven_chunks_audio(self):
+        chunk_audio = bytes(range(200))
+        audios = (chunk_audio[:30], chunk_audio[30:32], chunk_audio[32:])
+        chunks = [audio.AudioChunk(time.time(), sample, 2, 16000)
+                  for sample in audios]
+        chunk_iter = AListIter(chunks)
+        even_audio = b''
+        async for chunk in audio.EvenChunkIterator(chunk_iter, 25):
+            self.assertEqual(50, len(chunk.audio))
+            even_audio += chunk.audio
+        self.assertEqual(chunk_audio, even_audio)
+
     async def test_large_chunk(self):
         chunk_audio = bytes(range(100))
         large_chunk = audio.AudioChunk(time.time(), chunk_audio, 2, 16000)
@@ -83,6 +299,58 @@ class EvenChunkIteratorTestCase(base.TestCase):
         self.assertEqual(5, len(chunks))
         self.assertEqual(large_chunk, audio.merge_chunks(chunks))
 
+    async def test_attach(self):
+        chunks = [audio.AudioChunk(0, b'\1\0' * 15, 2, 16000)]
+        even_iter = audio.EvenChunkIterator(AListIter(chunks), 10)
+        chunk = await even_iter.__anext__()
+        self.assertEqual(b'\1\0' * 10, bytes(chunk.audio))
+        chunks = [audio.AudioChunk(1, b'\2\0' * 10, 2, 16000)]
+        even_iter.attach(AListIter(chunks))
+        chunk = await even_iter.__anext__()
+        self.assertEqual(b'\2\0' * 10, bytes(chunk.audio))
+        self.assertEqual(1, chunk.start_time)
+
+    async def test_large_chunk_not_copied(self):
+        chunk_audio = bytes(range(100))
+        chunks = [audio.AudioChunk(time.time(), chunk_audio, 2, 16000)] * 2
+        even_chunks = []
+        async for chunk in audio.EvenChunkIterator(AListIter(chunks), 40):
+            even_chunks.append(chunk)
+        self.assertEqual([80, 80], [len(x.audio) for x in even_chunks])
+        self.assertIsInstance(even_chunks[0].audio, memoryview)
+        self.assertEqual(chunk_audio[:80], even_chunks[0].audio)
+        self.assertEqual(chunk_audio[80:] + chunk_audio[:60],
+                         even_chunks[1].audio)
+
+
+class BlocksAudioSource(audio.AudioSource):
+    def __init__(self, blocks):
+        super(BlocksAudioSource, self).__init__()
+        self._blocks = iter(blocks)
+
+    async def _next_block(self):
+        try:
+            return next(self._blocks)
+        except StopIteration:
+            raise StopAsyncIteration()
+
+
+class AudioPlayerTestCase(base.TestCase):
+    async def test_play_buffers(self):
+        chunk_audio = bytearray(range(100))
+        buffers = (bytes(chunk_audio), chunk_audio, memoryview(chunk_audio))
+        block = audio.QueueAudioBlock()
+        for ndx, buff in enumerate(buffers):
+            await block.add_chunk(audio.AudioChunk(ndx, buff, 2, 16000))
+        await block.add_chunk(None)
+        fake_pyaudio = audio_fakes.FakePyAudio()
+        player = audio.AudioPlayer(BlocksAudioSource([block]), 2, 1, 16000)
+        with mock.patch.object(audio, 'pyaudio', create=True) as m_pyaudio:
+            m_pyaudio.PyAudio.return_value = fake_pyaudio
+            await player.play()
+        self.assertEqual([bytes(chunk_audio)] * 3,
+                         fake_pyaudio.stream.written)
+
 
 class WaveSourceTestCase(base.TestCase):
     async def test_hello_44100_wave_get_chunk(self):
@@ -106,14 +374,55 @@ class WaveSourceTestCase(base.TestCase):
         self.assertEqual(2, full_chunk.width)
         self.assertEqual(44100, full_chunk.freq)
 
+    async def test_to_mono_matches_audioop(self):
+        frames = bytes(range(256)) * 4
+        self.assertEqual(audioop.tomono(frames, 2, .5, .5),
+                         audio._to_mono(frames, 2))
+
 
 class SquelchedSourceTestCase(base.TestCase):
+    def _chunks(self, levels):
+        return [audio.AudioChunk(0, bytes([level, 0]) * 10, 2, 16000)
+                for level in levels]
+
+    async def test_check_squelch_matches_median(self):
+        for levels in ((1, 5, 9, 3), (9, 9, 1, 1), (1, 1, 9, 9), (4, 2, 8),
+                       (2, 4, 4, 8), (7,)):
+            median = sorted(levels)[len(levels) // 2]
+            for level in range(11):
+                for is_triggered in (True, False):
+                    if is_triggered:
+                        expected = not median < level * .8
+                    else:
+                        expected = median > level
+                    self.assertEqual(
+                        expected,
+                        audio.SquelchedSource.check_squelch(
+                            level, is_triggered, self._chunks(levels)
+                        ),
+                        (levels, level, is_triggered)
+                    )
+
+    async def test_check_squelch_skips_undecided_rms(self):
+        chunks = self._chunks((9, 9, 9, 1))
+        for chunk in chunks[:3]:
+            chunk.rms()
+        self.assertTrue(audio.SquelchedSource.check_squelch(5, False, chunks))
+        self.assertIsNone(chunks[3].cached_rms)
+
     async def test_detect_silent_level(self):
         a_s = audio.SquelchedSource(audio_fakes.SilentAudioSource())
         level = await a_s.detect_squelch_level(detect_time=.2)
         self.assertEqual(level, a_s.squelch_level)
         self.assertEqual(0, level)
 
+    async def test_select_matches_sorted(self):
+        vals = [(x * 7919) % 1009 for x in range(500)]
+        for ndx in (0, 1, 250, 499):
+            self.assertEqual(sorted(vals)[ndx], audio._select(vals, ndx))
+            self.assertEqual(sorted(vals[:10])[ndx % 10],
+                             audio._select(vals[:10], ndx % 10))
+
     async def test_get_silent_chunk(self):
         a_s = audio.SquelchedSource(audio_fakes.SilentAudioSource(),
                                     squelch_level=10)
@@ -138,3 +447,50 @@ class SquelchedSourceTestCase(base.TestCase):
                     chunks.append(chunk)
         self.assertEqual(1, block_cnt)
         self.assertEqual(15, len(chunks))
+
+    async def test_multiple_source_blocks(self):
+        blocks = []
+        for level in (1, 2):
+            block = audio.QueueAudioBlock()
+            for ndx in range(6):
+                await block.add_chunk(audio.AudioChunk(
+                    ndx, bytes([level, 100]) * 10, 2, 16000
+                ))
+            await block.add_chunk(None)
+            blocks.append(block)
+        a_s = audio.SquelchedSource(BlocksAudioSource(blocks), sample_size=10,
+                                    squelch_level=200, prefix_samples=2)
+        audios = []
+        async with a_s.listen():
+            async for block in a_s:
+                block_audio = b''
+                async for chunk in block:
+                    block_audio += bytes(chunk.audio)
+                audios.append(block_audio)
+        self.assertEqual([bytes([1, 100]) * 60, bytes([2, 100]) * 60],
+                         audios)
+
+
+class RateConvertTestCase(base.TestCase):
+    async def test_chunked_resample_matches_whole(self):
+        if audio.sliding_window_view is None:
+            self.skipTest('NumPy 1.20 or newer is not installed')
+        samples = bytes(range(256)) * 40
+        whole = audio._PolyphaseResampler(44100, 16000).process(samples)
+        resampler = audio._PolyphaseResampler(44100, 16000)
+        chunked = b''.join(resampler.process(samples[ndx:ndx + 300])
+                           for ndx in range(0, len(samples), 300))
+        self.assertAlmostEqual(len(samples) / 2 * 16000 / 44100,
+                               len(whole) / 2, delta=1)
+        self.assertEqual(whole, chunked)
+
+    async def test_resample_empty(self):
+        if audio.sliding_window_view is None:
+            self.skipTest('NumPy 1.20 or newer is not installed')
+        resampler = audio._PolyphaseResampler(44100, 16000)
+        self.assertEqual(b'', resampler.process(b''))
+
+    async def test_unknown_quality(self):
+        with self.assertRaises(ValueError):
+            audio.RateConvert(audio_fakes.SilentAudioSource(), 1, 16000,
+                              quality='best')